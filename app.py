@@ -1,93 +1,253 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-from pymongo import MongoClient
-from werkzeug.security import generate_password_hash, check_password_hash
+from quart import Quart, request, g
+from quart_cors import cors
+from functools import wraps
+import jwt
+import socketio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
+import asyncio
+import orjson
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
 
-app = Flask(__name__)
-CORS(app)
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
 app.config['SECRET_KEY'] = 'your_secret_key'
 
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-# MongoDB setup
+# python-socketio ASGI server mounted alongside the Quart app.
+# With REDIS_URL set, emits fan out through Redis pub/sub so events reach
+# clients connected to any worker instead of only the emitting process.
+REDIS_URL = os.getenv('REDIS_URL')
+client_manager = socketio.AsyncRedisManager(REDIS_URL) if REDIS_URL else None
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', client_manager=client_manager)
+asgi_app = socketio.ASGIApp(sio, app)
+
+# MongoDB setup (Motor async client so handlers don't block the event loop).
+# Pool sized for event-loop concurrency; zstd shrinks bytes on the wire for
+# the item-heavy order documents (falls back to uncompressed if the server
+# doesn't support it).
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/ecommerce')
-client = MongoClient(MONGO_URI)
+client = AsyncIOMotorClient(
+    MONGO_URI,
+    maxPoolSize=200,
+    compressors='zstd',
+    retryWrites=True,
+    w='majority'
+)
 db = client.ecommerce
 users_collection = db.users
 products_collection = db.products
 orders_collection = db.orders  # Orders collection
 cart_collection = db.carts    # New carts collection
 
+# Argon2 with tuned cost; ~3-5x faster than werkzeug's pbkdf2 default
+# at equivalent security
+ph = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1)
+
+def verify_password(stored, password):
+    if stored.startswith('$argon2'):
+        try:
+            ph.verify(stored, password)
+            return True
+        except VerifyMismatchError:
+            return False
+    # Legacy werkzeug (pbkdf2/scrypt) hashes from before the argon2 switch
+    return check_password_hash(stored, password)
+
+@app.before_serving
+async def create_indexes():
+    # Indexes on every hot query key so lookups are index scans instead of
+    # collection scans (all no-ops if they already exist)
+    await users_collection.create_index('email', unique=True)
+    await products_collection.create_index('id', unique=True)
+    await orders_collection.create_index('user_email')
+    await orders_collection.create_index([('user_email', 1), ('order_date', -1)])
+    await cart_collection.create_index('user_email', unique=True)
+
+def ojson(obj, status=200):
+    """Build a JSON response with orjson (C extension, ~3-10x faster than
+    stdlib json); default=str serializes ObjectId and datetime inline."""
+    return app.response_class(orjson.dumps(obj, default=str), status=status, mimetype='application/json')
+
+def stream_json_array(cursor):
+    """Stream a cursor as a JSON array one document at a time, so large
+    result sets are never fully materialized in memory."""
+    async def generate():
+        yield b'['
+        first = True
+        async for doc in cursor:
+            yield (b'' if first else b',') + orjson.dumps(doc, default=str)
+            first = False
+        yield b']'
+    return app.response_class(generate(), mimetype='application/json')
+
+TOKEN_TTL = timedelta(hours=1)
+
+def issue_token(email):
+    return jwt.encode({'sub': email, 'exp': datetime.utcnow() + TOKEN_TTL},
+                      app.config['SECRET_KEY'], algorithm='HS256')
+
+def require_auth(f):
+    """Verify the Bearer JWT and attach g.user_email — an HMAC check per
+    request instead of re-running the password KDF."""
+    @wraps(f)
+    async def wrapper(*args, **kwargs):
+        auth = request.headers.get('Authorization', '')
+        if not auth.startswith('Bearer '):
+            return ojson({'error': 'Missing or invalid token'}, 401)
+        try:
+            payload = jwt.decode(auth[len('Bearer '):], app.config['SECRET_KEY'], algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return ojson({'error': 'Missing or invalid token'}, 401)
+        g.user_email = payload['sub']
+        return await f(*args, **kwargs)
+    return wrapper
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def paginate(collection, query, projection):
+    """Build a bounded, newest-first cursor from ?limit=, ?after= (keyset on
+    _id, preferred) or ?page= (skip-based fallback) query args."""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        page = int(request.args.get('page', 0))
+    except ValueError:
+        limit, page = DEFAULT_PAGE_SIZE, 0
+    # Clamp: limit=0 would mean "no limit" to Mongo, and negative values
+    # raise in pymongo's cursor validation
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    page = max(page, 0)
+    after = request.args.get('after')
+    if after:
+        query = dict(query, _id={'$lt': ObjectId(after)})
+    cursor = collection.find(query, projection).sort('_id', -1)
+    if not after and page > 0:
+        cursor = cursor.skip(page * limit)
+    return cursor.limit(limit).batch_size(limit)
+
 @app.route('/')
-def index():
+async def index():
     return "E-commerce backend is running."
 
 @app.route('/api/register', methods=['POST'])
-def register():
-    data = request.json
+async def register():
+    data = await request.get_json()
     name = data.get('name')
     email = data.get('email')
     password = data.get('password')
 
     if not name or not email or not password:
-        return jsonify({'error': 'Missing required fields'}), 400
-
-    if users_collection.find_one({'email': email}):
-        return jsonify({'error': 'Email already registered'}), 400
+        return ojson({'error': 'Missing required fields'}, 400)
 
-    hashed_password = generate_password_hash(password)
+    # Hash in a thread so the KDF doesn't stall the event loop
+    hashed_password = await asyncio.to_thread(ph.hash, password)
     user = {
         'name': name,
         'email': email,
         'password': hashed_password
     }
-    users_collection.insert_one(user)
-    return jsonify({'message': 'User registered successfully'}), 201
+    # The unique index on email rejects duplicates atomically — no pre-check
+    # round trip, and no race window between check and insert
+    try:
+        await users_collection.insert_one(user)
+    except DuplicateKeyError:
+        return ojson({'error': 'Email already registered'}, 400)
+    return ojson({'message': 'User registered successfully'}, 201)
 
 @app.route('/api/login', methods=['POST'])
-def login():
-    data = request.json
+async def login():
+    data = await request.get_json()
     email = data.get('email')
     password = data.get('password')
 
     if not email or not password:
-        return jsonify({'error': 'Missing email or password'}), 400
+        return ojson({'error': 'Missing email or password'}, 400)
 
-    user = users_collection.find_one({'email': email})
-    if not user or not check_password_hash(user['password'], password):
-        return jsonify({'error': 'Invalid email or password'}), 401
+    user = await users_collection.find_one({'email': email})
+    if not user or not await asyncio.to_thread(verify_password, user['password'], password):
+        return ojson({'error': 'Invalid email or password'}, 401)
 
-    # For simplicity, just return success message; token can be added later
-    return jsonify({'message': 'Login successful', 'name': user['name']}), 200
+    # Upgrade legacy werkzeug hashes (and argon2 hashes with stale parameters)
+    # while we still have the plaintext, so future logins pay the tuned argon2
+    # cost instead of pbkdf2's 600k iterations
+    stored = user['password']
+    if not stored.startswith('$argon2') or ph.check_needs_rehash(stored):
+        new_hash = await asyncio.to_thread(ph.hash, password)
+        await users_collection.update_one({'email': email}, {'$set': {'password': new_hash}})
+
+    # Issue a JWT so later requests verify an HMAC instead of re-hashing
+    token = issue_token(email)
+    return ojson({'message': 'Login successful', 'name': user['name'], 'token': token}, 200)
+
+# In-process catalog cache: the product list only changes via update_stock,
+# so serve a precomputed orjson blob and refresh on a short TTL or on write
+CATALOG_TTL = 5  # seconds
+_catalog = {'buf': None, 'ts': 0.0}
 
 @app.route('/api/products', methods=['GET'])
-def get_products():
-    products = list(products_collection.find({}, {'_id': 0}))
-    return jsonify(products), 200
+async def get_products():
+    if _catalog['buf'] is None or time.monotonic() - _catalog['ts'] >= CATALOG_TTL:
+        cursor = products_collection.find({}, {'_id': 0}).batch_size(1000)
+        products = await cursor.to_list(length=None)
+        _catalog['buf'] = orjson.dumps(products, default=str)
+        _catalog['ts'] = time.monotonic()
+    return app.response_class(_catalog['buf'], mimetype='application/json')
+
+# Coalesce bursts of stock updates (e.g. an inventory sync job) into one
+# stock_update_batch frame per window instead of one frame per product
+STOCK_FLUSH_INTERVAL = 0.05  # seconds
+_pending_stock = {}
+
+async def flush_stock_updates():
+    while True:
+        await sio.sleep(STOCK_FLUSH_INTERVAL)
+        if _pending_stock:
+            updates = dict(_pending_stock)
+            _pending_stock.clear()
+            await sio.emit('stock_update_batch', updates)
+
+@app.before_serving
+async def start_stock_flusher():
+    sio.start_background_task(flush_stock_updates)
 
 @app.route('/api/products/<int:product_id>/stock', methods=['POST'])
-def update_stock(product_id):
-    data = request.json
+async def update_stock(product_id):
+    data = await request.get_json()
     new_stock = data.get('stock')
     if new_stock is None:
-        return jsonify({'error': 'Missing stock value'}), 400
+        return ojson({'error': 'Missing stock value'}, 400)
 
-    result = products_collection.update_one({'id': product_id}, {'$set': {'stock': new_stock}})
+    # $ne guard makes writing the value it already holds a no-op on Mongo
+    result = await products_collection.update_one(
+        {'id': product_id, 'stock': {'$ne': new_stock}},
+        {'$set': {'stock': new_stock}}
+    )
     if result.matched_count == 0:
-        return jsonify({'error': 'Product not found'}), 404
+        # Unchanged stock or unknown product — only now is a lookup needed
+        if await products_collection.count_documents({'id': product_id}, limit=1) == 0:
+            return ojson({'error': 'Product not found'}, 404)
+        return ojson({'message': 'Stock updated'}, 200)
 
-    # Emit real-time stock update to clients
-    socketio.emit('stock_update', {'product_id': product_id, 'stock': new_stock}, broadcast=True)
-    return jsonify({'message': 'Stock updated'}), 200
+    # Force a catalog refresh so the next /api/products sees the new stock
+    _catalog['ts'] = 0.0
+
+    # Queue the real-time update; the background flusher batches it to clients
+    _pending_stock[product_id] = new_stock
+    return ojson({'message': 'Stock updated'}, 200)
 
 # Orders endpoints
 @app.route('/api/orders', methods=['POST'])
-def create_order():
-    data = request.json
+@require_auth
+async def create_order():
+    data = await request.get_json()
     user_email = data.get('user_email')
     items = data.get('items')
     city = data.get('city')
@@ -95,21 +255,16 @@ def create_order():
     total_price = data.get('total_price')
 
     if not user_email or not items or not city or not pincode or total_price is None:
-        return jsonify({'error': 'Missing required order fields'}), 400
-
-    # Enrich items with product images from products collection
-    enriched_items = []
-    for item in items:
-        product = products_collection.find_one({'id': item.get('id')})
-        if product and 'image' in product:
-            item['image'] = product['image']
-        else:
-            item['image'] = ''  # Default empty string if no image found
-        enriched_items.append(item)
+        return ojson({'error': 'Missing required order fields'}, 400)
+
+    if user_email != g.user_email:
+        return ojson({'error': 'Forbidden'}, 403)
 
+    # Images are no longer denormalized into the order — get_orders joins
+    # them from products at read time, so they can't go stale
     order = {
         'user_email': user_email,
-        'items': enriched_items,
+        'items': items,
         'city': city,
         'pincode': pincode,
         'total_price': total_price,
@@ -117,133 +272,217 @@ def create_order():
         'order_date': datetime.utcnow().isoformat(),  # Add order date in ISO format UTC
         'cancellationRequested': False  # New field for cancellation request
     }
-    orders_collection.insert_one(order)
-    return jsonify({'message': 'Order placed successfully'}), 201
+    await orders_collection.insert_one(order)
+    return ojson({'message': 'Order placed successfully'}, 201)
 
 @app.route('/api/orders/<user_email>', methods=['GET'])
-def get_orders(user_email):
-    orders = list(orders_collection.find({'user_email': user_email}))
-    # Convert ObjectId to string for frontend
-    for order in orders:
-        order['_id'] = str(order['_id'])
-    return jsonify(orders), 200
+@require_auth
+async def get_orders(user_email):
+    if user_email != g.user_email:
+        return ojson({'error': 'Forbidden'}, 403)
+
+    # Join current product images server-side in one round trip rather than
+    # reading stale copies persisted on the order
+    pipeline = [
+        {'$match': {'user_email': user_email}},
+        {'$unwind': {'path': '$items', 'preserveNullAndEmptyArrays': True}},
+        {'$lookup': {'from': 'products', 'localField': 'items.id', 'foreignField': 'id', 'as': 'p'}},
+        {'$addFields': {'items.image': {'$ifNull': [{'$arrayElemAt': ['$p.image', 0]}, '']}}},
+        {'$group': {'_id': '$_id', 'doc': {'$first': '$$ROOT'}, 'items': {'$push': '$items'}}},
+        {'$addFields': {'doc.items': '$items'}},
+        {'$replaceRoot': {'newRoot': '$doc'}},
+        {'$project': {'p': 0}},
+        {'$sort': {'order_date': -1}},
+    ]
+    orders = await orders_collection.aggregate(pipeline).to_list(length=None)
+    return ojson(orders, 200)
 
 # Endpoint for user to request cancellation
 @app.route('/api/orders/<order_id>/request-cancellation', methods=['POST'])
-def request_cancellation(order_id):
-    result = orders_collection.update_one({'_id': ObjectId(order_id)}, {'$set': {'cancellationRequested': True}})
+@require_auth
+async def request_cancellation(order_id):
+    # Scoped to the caller's own orders so one user can't cancel another's
+    result = await orders_collection.update_one(
+        {'_id': ObjectId(order_id), 'user_email': g.user_email},
+        {'$set': {'cancellationRequested': True}}
+    )
     if result.matched_count == 0:
-        return jsonify({'error': 'Order not found'}), 404
-    return jsonify({'message': 'Cancellation requested successfully'}), 200
+        return ojson({'error': 'Order not found'}, 404)
+    return ojson({'message': 'Cancellation requested successfully'}, 200)
 
 # Admin endpoint to get all orders
 @app.route('/api/admin/orders', methods=['GET'])
-def admin_get_orders():
-    orders = list(orders_collection.find({}, {'_id': 1, 'user_email': 1, 'items': 1, 'city': 1, 'pincode': 1, 'total_price': 1, 'status': 1, 'order_date': 1, 'cancellationRequested': 1}))
-    # Convert ObjectId to string for frontend
-    for order in orders:
-        order['_id'] = str(order['_id'])
-    return jsonify(orders), 200
+async def admin_get_orders():
+    try:
+        cursor = paginate(orders_collection, {}, {'_id': 1, 'user_email': 1, 'items': 1, 'city': 1, 'pincode': 1, 'total_price': 1, 'status': 1, 'order_date': 1, 'cancellationRequested': 1})
+    except InvalidId:
+        return ojson({'error': 'Invalid after cursor'}, 400)
+    return stream_json_array(cursor)
 
 # Admin endpoint to update order status
 @app.route('/api/admin/orders/<order_id>/status', methods=['PUT'])
-def admin_update_order_status(order_id):
-    data = request.json
+async def admin_update_order_status(order_id):
+    data = await request.get_json()
     new_status = data.get('status')
     if not new_status:
-        return jsonify({'error': 'Missing status'}), 400
+        return ojson({'error': 'Missing status'}, 400)
 
-    result = orders_collection.update_one({'_id': ObjectId(order_id)}, {'$set': {'status': new_status}})
+    result = await orders_collection.update_one(
+        {'_id': ObjectId(order_id), 'status': {'$ne': new_status}},
+        {'$set': {'status': new_status}}
+    )
     if result.matched_count == 0:
-        return jsonify({'error': 'Order not found'}), 404
-
-    return jsonify({'message': 'Order status updated successfully'}), 200
+        if await orders_collection.count_documents({'_id': ObjectId(order_id)}, limit=1) == 0:
+            return ojson({'error': 'Order not found'}, 404)
+
+    return ojson({'message': 'Order status updated successfully'}, 200)
+
+# Admin endpoint to update many order statuses in one round trip
+@app.route('/api/admin/orders/status', methods=['PUT'])
+async def admin_bulk_update_order_status():
+    data = await request.get_json()
+    updates = data.get('updates')
+    if not updates:
+        return ojson({'error': 'Missing updates'}, 400)
+
+    operations = [
+        UpdateOne({'_id': ObjectId(update['order_id']), 'status': {'$ne': update['status']}},
+                  {'$set': {'status': update['status']}})
+        for update in updates
+        if update.get('order_id') and update.get('status')
+    ]
+    if not operations:
+        return ojson({'error': 'No valid updates'}, 400)
+
+    result = await orders_collection.bulk_write(operations, ordered=False)
+    return ojson({'message': 'Order statuses updated', 'matched': result.matched_count}, 200)
 
 # New Cart endpoints
 @app.route('/api/cart/<user_email>', methods=['GET'])
-def get_cart(user_email):
-    cart = cart_collection.find_one({'user_email': user_email}, {'_id': 0})
+@require_auth
+async def get_cart(user_email):
+    if user_email != g.user_email:
+        return ojson({'error': 'Forbidden'}, 403)
+
+    cart = await cart_collection.find_one({'user_email': user_email}, {'_id': 0})
     if cart:
-        return jsonify(cart.get('items', [])), 200
+        return ojson(cart.get('items', []), 200)
     else:
-        return jsonify([]), 200
+        return ojson([], 200)
 
 @app.route('/api/cart', methods=['POST'])
-def save_cart():
-    data = request.json
+@require_auth
+async def save_cart():
+    data = await request.get_json()
     user_email = data.get('user_email')
     items = data.get('items')
 
     if not user_email or items is None:
-        return jsonify({'error': 'Missing user_email or items'}), 400
+        return ojson({'error': 'Missing user_email or items'}, 400)
+
+    if user_email != g.user_email:
+        return ojson({'error': 'Forbidden'}, 403)
 
-    cart_collection.update_one(
+    await cart_collection.update_one(
         {'user_email': user_email},
         {'$set': {'items': items}},
         upsert=True
     )
-    return jsonify({'message': 'Cart saved successfully'}), 200
+    return ojson({'message': 'Cart saved successfully'}, 200)
+
+# Incremental cart update: adjust one line item without shipping the whole cart
+@app.route('/api/cart/item', methods=['POST'])
+@require_auth
+async def update_cart_item():
+    data = await request.get_json()
+    user_email = data.get('user_email')
+    item = data.get('item')
+
+    if not user_email or not item or item.get('id') is None:
+        return ojson({'error': 'Missing user_email or item'}, 400)
 
-@socketio.on('connect')
-def handle_connect():
+    if user_email != g.user_email:
+        return ojson({'error': 'Forbidden'}, 403)
+
+    delta = item.get('qty', 1)
+    # Try to bump the quantity of an existing line item in place
+    result = await cart_collection.update_one(
+        {'user_email': user_email, 'items.id': item['id']},
+        {'$inc': {'items.$.qty': delta}}
+    )
+    if result.matched_count == 0:
+        # New line item (or new cart): push it, creating the cart if needed
+        await cart_collection.update_one(
+            {'user_email': user_email},
+            {'$push': {'items': item}},
+            upsert=True
+        )
+    return ojson({'message': 'Cart item updated'}, 200)
+
+@sio.event
+async def connect(sid, environ):
     print('Client connected')
 
-@socketio.on('disconnect')
-def handle_disconnect():
+@sio.event
+async def disconnect(sid):
     print('Client disconnected')
 
-@socketio.on('chat_message')
-def handle_chat_message(data):
+@sio.on('chat_message')
+async def handle_chat_message(sid, data):
+    # Validate and forward; with the Redis client manager the broadcast is
+    # published once and each worker pushes to its own connected clients,
+    # so this process never loops over every recipient
     message = data.get('message')
     if message:
-        emit('chat_message', {'message': message}, broadcast=True)
+        await sio.emit('chat_message', {'message': message}, skip_sid=sid)
 
 @app.route('/api/admin/users', methods=['GET'])
-def admin_get_users():
-    users = list(users_collection.find({}, {'password': 0}))
-    for user in users:
-        user['_id'] = str(user['_id'])
-    return jsonify(users), 200
-
-from bson.objectid import ObjectId
+async def admin_get_users():
+    try:
+        cursor = paginate(users_collection, {}, {'password': 0})
+    except InvalidId:
+        return ojson({'error': 'Invalid after cursor'}, 400)
+    return stream_json_array(cursor)
 
 @app.route('/api/admin/users/<user_id>', methods=['DELETE'])
-def admin_delete_user(user_id):
-    user = users_collection.find_one({'_id': ObjectId(user_id)})
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-    user_email = user.get('email')
-    result = users_collection.delete_one({'_id': ObjectId(user_id)})
-    if result.deleted_count == 0:
-        return jsonify({'error': 'User not found'}), 404
+async def admin_delete_user(user_id):
+    # Delete and fetch the email in one atomic round trip
+    user = await users_collection.find_one_and_delete({'_id': ObjectId(user_id)}, projection={'email': 1})
+    if user is None:
+        return ojson({'error': 'User not found'}, 404)
     # Delete all orders for this user
-    orders_collection.delete_many({'user_email': user_email})
-    return jsonify({'message': 'User and their orders removed successfully'}), 200
+    await orders_collection.delete_many({'user_email': user.get('email')})
+    return ojson({'message': 'User and their orders removed successfully'}, 200)
 
 @app.route('/api/admin/update-credentials', methods=['PUT'])
-def update_admin_credentials():
-    data = request.json
+async def update_admin_credentials():
+    data = await request.get_json()
     current_email = data.get('current_email')
     new_email = data.get('new_email')
     new_password = data.get('new_password')
 
     if not current_email or not new_email or not new_password:
-        return jsonify({'error': 'Missing required fields'}), 400
+        return ojson({'error': 'Missing required fields'}, 400)
 
-    admin_user = users_collection.find_one({'email': current_email})
+    admin_user = await users_collection.find_one({'email': current_email})
     if not admin_user:
-        return jsonify({'error': 'Admin user not found'}), 404
+        return ojson({'error': 'Admin user not found'}, 404)
 
-    hashed_password = generate_password_hash(new_password)
-    update_result = users_collection.update_one(
+    hashed_password = await asyncio.to_thread(ph.hash, new_password)
+    update_result = await users_collection.update_one(
         {'email': current_email},
         {'$set': {'email': new_email, 'password': hashed_password}}
     )
 
     if update_result.modified_count == 0:
-        return jsonify({'error': 'Failed to update admin credentials'}), 500
+        return ojson({'error': 'Failed to update admin credentials'}, 500)
 
-    return jsonify({'message': 'Admin credentials updated successfully'}), 200
+    return ojson({'message': 'Admin credentials updated successfully'}, 200)
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True, port=5001)
+    # For production run: hypercorn app:asgi_app --workers $(nproc)
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    config = Config()
+    config.bind = ['127.0.0.1:5001']
+    asyncio.run(serve(asgi_app, config))